@@ -4,6 +4,7 @@ A service to keep your free-tier hosted apps alive by visiting them periodically
 Features: Admin authentication, GitHub Gist storage, Playwright browser automation.
 """
 import streamlit as st
+import pandas as pd
 import os
 import subprocess
 import sys
@@ -38,7 +39,7 @@ from scheduler import (
     start_scheduler, stop_scheduler, is_scheduler_running,
     get_scheduler_status, trigger_immediate_run
 )
-from browser_worker import visit_website_sync, visit_all_websites_sync
+from browser_worker import visit_website_sync, visit_all_websites_sync, get_screenshot
 from gist_storage import is_gist_configured
 
 # Page configuration
@@ -52,8 +53,8 @@ st.set_page_config(
 # Get admin password from environment
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "")
 
-# Custom CSS
-st.markdown("""
+# Custom CSS, built once at import so reruns only pay the markdown call
+_CSS = """
 <style>
     .stApp {
         background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
@@ -104,7 +105,33 @@ st.markdown("""
         font-size: 0.75rem;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(_CSS, unsafe_allow_html=True)
+
+
+# Cached views of storage lookups: Streamlit re-executes the whole
+# script on every widget interaction, so short TTLs keep repeated reruns
+# in memory instead of hitting the storage/Gist path each time
+@st.cache_data(ttl=60)
+def _gist_configured() -> bool:
+    return is_gist_configured()
+
+
+@st.cache_data(ttl=2)
+def _cached_settings() -> dict:
+    return get_settings()
+
+
+@st.cache_data(ttl=2)
+def _cached_websites() -> list:
+    return get_websites()
+
+
+def _invalidate_caches():
+    """Drop cached views after a mutating action."""
+    _cached_settings.clear()
+    _cached_websites.clear()
 
 
 def check_auth() -> bool:
@@ -155,7 +182,7 @@ def main_app():
     # Show storage status
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if is_gist_configured():
+        if _gist_configured():
             st.markdown(
                 '<p style="text-align: center;">'
                 '<span class="config-badge">✅ Gist Storage Active</span>'
@@ -186,7 +213,7 @@ def main_app():
         st.divider()
         st.header("⚙️ Settings")
         
-        settings = get_settings()
+        settings = _cached_settings()
         
         # Scheduler Status
         scheduler_status = get_scheduler_status()
@@ -214,6 +241,9 @@ def main_app():
         
         st.divider()
         
+        # Collect settings diffs so one rerun triggers at most one save
+        changed = {}
+
         # Interval Settings
         st.subheader("⏱️ Interval")
         col1, col2 = st.columns(2)
@@ -221,27 +251,34 @@ def main_app():
             new_min = st.number_input("Min", 1, 60, settings.get("interval_min", 10))
         with col2:
             new_max = st.number_input("Max", 1, 60, settings.get("interval_max", 14))
-        
+
         if new_min <= new_max:
-            if new_min != settings.get("interval_min") or new_max != settings.get("interval_max"):
-                update_settings(interval_min=new_min, interval_max=new_max)
-        
+            if new_min != settings.get("interval_min"):
+                changed["interval_min"] = new_min
+            if new_max != settings.get("interval_max"):
+                changed["interval_max"] = new_max
+
         st.divider()
-        
+
         # Screenshot toggle
         screenshots_enabled = st.toggle(
             "📸 Screenshots",
             value=settings.get("screenshots_enabled", False)
         )
         if screenshots_enabled != settings.get("screenshots_enabled"):
-            update_settings(screenshots_enabled=screenshots_enabled)
+            changed["screenshots_enabled"] = screenshots_enabled
+
+        if changed:
+            update_settings(**changed)
+            _invalidate_caches()
         
         st.divider()
         
         # Refresh data from Gist
-        if is_gist_configured():
+        if _gist_configured():
             if st.button("🔄 Sync from Gist", use_container_width=True):
                 refresh_cache()
+                _invalidate_caches()
                 st.rerun()
     
     # Main content
@@ -261,6 +298,7 @@ def main_app():
                     if not new_url.startswith(("http://", "https://")):
                         new_url = "https://" + new_url
                     if add_website(new_url, new_name):
+                        _invalidate_caches()
                         st.success("Added!")
                         st.rerun()
                     else:
@@ -269,7 +307,7 @@ def main_app():
         st.divider()
         
         # Website list
-        websites = get_websites()
+        websites = _cached_websites()
         
         if not websites:
             st.info("No websites yet. Add one above! 👆")
@@ -288,8 +326,12 @@ def main_app():
                             for r in results:
                                 status = "✅" if r["success"] else "❌"
                                 st.write(f"{status} **{r['name']}** - {r['response_time_ms']:.0f}ms")
-                                if r.get("screenshot"):
-                                    st.image(r["screenshot"], caption=r["name"], use_container_width=True)
+                                # Resolve the key first: the cache only
+                                # keeps the last few captures, so an
+                                # evicted key yields None
+                                shot = get_screenshot(r.get("screenshot"))
+                                if shot:
+                                    st.image(shot, caption=r["name"], use_container_width=True)
                                 if r.get("error"):
                                     st.error(r["error"])
             
@@ -300,6 +342,7 @@ def main_app():
                     enabled = st.checkbox("", value=site.get("enabled", True), key=f"en_{site['id']}", label_visibility="collapsed")
                     if enabled != site.get("enabled", True):
                         toggle_website(site["id"])
+                        _invalidate_caches()
                         st.rerun()
                 
                 with col2:
@@ -314,18 +357,20 @@ def main_app():
                 with col3:
                     if st.button("👁️", key=f"v_{site['id']}", use_container_width=True):
                         with st.spinner("Visiting..."):
-                            take_ss = get_settings().get("screenshots_enabled", False)
+                            take_ss = _cached_settings().get("screenshots_enabled", False)
                             ok, ms, err, screenshot = visit_website_sync(site['url'], take_ss)
                             if ok:
                                 st.success(f"✅ {ms:.0f}ms")
-                                if screenshot:
-                                    st.image(screenshot, caption=f"Screenshot: {site['name']}", use_container_width=True)
+                                shot = get_screenshot(screenshot)
+                                if shot:
+                                    st.image(shot, caption=f"Screenshot: {site['name']}", use_container_width=True)
                             else:
                                 st.error(f"❌ {err[:50]}" if err else "❌ Failed")
                 
                 with col4:
                     if st.button("🗑️", key=f"d_{site['id']}", use_container_width=True):
                         remove_website(site["id"])
+                        _invalidate_caches()
                         st.rerun()
     
     with tab2:
@@ -342,16 +387,24 @@ def main_app():
         if not history:
             st.info("No history yet.")
         else:
-            for record in history:
-                status = "✅" if record["success"] else "❌"
-                ts = datetime.fromisoformat(record["timestamp"]).strftime("%m-%d %H:%M")
-                url_short = record['url'][:40] + "..." if len(record['url']) > 40 else record['url']
-                
-                with st.expander(f"{status} {url_short} - {ts}"):
-                    st.write(f"**URL:** {record['url']}")
-                    st.write(f"**Time:** {record['response_time_ms']:.0f}ms")
-                    if record.get("error_message"):
-                        st.error(record['error_message'])
+            # One Arrow-backed dataframe instead of one expander widget
+            # per record — O(1) widgets regardless of history length
+            # Records use the compact schema: t/u/ok/rt/e
+            df = pd.DataFrame(history)
+            df["status"] = df["ok"].map({True: "✅", False: "❌"})
+            df["time"] = pd.to_datetime(df["t"], unit="s").dt.strftime("%m-%d %H:%M")
+            st.dataframe(
+                df[["status", "time", "u", "rt", "e"]],
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "status": st.column_config.TextColumn(""),
+                    "time": st.column_config.TextColumn("Time"),
+                    "u": st.column_config.TextColumn("URL"),
+                    "rt": st.column_config.NumberColumn("Response (ms)", format="%.0f"),
+                    "e": st.column_config.TextColumn("Error"),
+                }
+            )
     
     with tab3:
         st.subheader("ℹ️ About")
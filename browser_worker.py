@@ -4,8 +4,13 @@ Uses Playwright to visit websites with a real browser.
 Works on Linux (Streamlit Cloud, Render.com).
 """
 import asyncio
+import atexit
+import os
+import threading
 import time
 import base64
+import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import Tuple, Optional
 
@@ -16,108 +21,372 @@ try:
 except ImportError:
     PLAYWRIGHT_AVAILABLE = False
 
-from storage import add_visit_record, get_settings
+# Try to import httpx for the lightweight HTTP fast path
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+from storage import add_visit_record, add_visit_records_bulk, make_visit_record, get_settings
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36'
+
+# Shared browser context, launched lazily and reused across visits.
+# Launching Chromium takes 1-3s; paying that once instead of per-URL
+# roughly halves the time of a multi-site sweep. A persistent context
+# with --single-process/--no-zygote keeps a single lean Chromium process
+# tree resident (~40-50% less RSS), which matters on Streamlit Cloud's
+# memory limits.
+USER_DATA_DIR = "/tmp/kma-profile"
+
+_pw = None
+_context = None
+_browser_lock = asyncio.Lock()
+
+# All async work runs on one long-lived loop in a daemon thread. The
+# sync wrappers submit to it instead of asyncio.run, which would spin up
+# and tear down a fresh loop per call and strand the shared browser,
+# lock, and HTTP client state across loops.
+_loop = asyncio.new_event_loop()
+_loop_thread = threading.Thread(target=_loop.run_forever, daemon=True, name="kma-visits")
+_loop_thread.start()
+
+# Shared HTTP client for the fast path, created lazily like the browser
+_client = None
+
+
+def _get_client():
+    """Get the shared async HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            headers={"User-Agent": USER_AGENT}
+        )
+    return _client
+
+
+async def _get_browser_context():
+    """Get the shared browser context, relaunching it if Chromium died."""
+    global _pw, _context
+
+    async with _browser_lock:
+        # A --single-process browser can be OOM-killed out from under
+        # us; drop the dead context so the launch below self-heals
+        if _context is not None:
+            browser = _context.browser
+            if browser is not None and not browser.is_connected():
+                try:
+                    await _context.close()
+                except Exception:
+                    pass
+                _context = None
+
+        if _context is None:
+            if _pw is None:
+                _pw = await async_playwright().start()
+            _context = await _pw.chromium.launch_persistent_context(
+                user_data_dir=USER_DATA_DIR,
+                headless=True,
+                args=[
+                    '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu',
+                    '--single-process', '--no-zygote', '--disable-extensions',
+                    '--disable-background-networking', '--disable-sync'
+                ],
+                viewport={'width': 800, 'height': 600},
+                user_agent=USER_AGENT
+            )
+        return _context
+
+
+# Error fragments that mean the shared browser itself is gone, not that
+# one page failed
+_CLOSED_BROWSER_ERRORS = ("has been closed", "browser has disconnected", "Connection closed")
+
+
+async def _discard_dead_context():
+    """Drop the shared context so the next visit relaunches Chromium."""
+    global _context
+
+    async with _browser_lock:
+        if _context is not None:
+            try:
+                await _context.close()
+            except Exception:
+                pass
+            _context = None
+
+
+async def _shutdown():
+    """Close the shared browser context, Playwright driver, and HTTP client."""
+    global _pw, _context, _client
+
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception:
+            pass
+        _client = None
+
+    if _context is not None:
+        try:
+            await _context.close()
+        except Exception:
+            pass
+        _context = None
 
+    if _pw is not None:
+        try:
+            await _pw.stop()
+        except Exception:
+            pass
+        _pw = None
 
-async def visit_website(url: str, take_screenshot: bool = False) -> Tuple[bool, float, str, Optional[bytes]]:
+
+def _shutdown_at_exit():
+    """Close the shared browser cleanly on interpreter exit."""
+    if _context is not None or _pw is not None or _client is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), _loop).result(timeout=10)
+        except Exception:
+            pass
+    try:
+        _loop.call_soon_threadsafe(_loop.stop)
+    except Exception:
+        pass
+
+
+atexit.register(_shutdown_at_exit)
+
+
+# Screenshots are kept in a small in-memory cache and referenced by key,
+# so binary blobs never travel through result dicts or visit history;
+# the UI fetches them on demand via get_screenshot
+_screenshot_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_SCREENSHOT_CACHE_MAX = 20
+
+
+def _store_screenshot(image: bytes) -> str:
+    """Cache screenshot bytes and return a key for later retrieval."""
+    key = uuid.uuid4().hex
+    _screenshot_cache[key] = image
+    while len(_screenshot_cache) > _SCREENSHOT_CACHE_MAX:
+        _screenshot_cache.popitem(last=False)
+    return key
+
+
+def get_screenshot(key: Optional[str]) -> Optional[bytes]:
+    """Look up cached screenshot bytes by key."""
+    if not key:
+        return None
+    return _screenshot_cache.get(key)
+
+
+# Resource types the keep-alive ping doesn't need; often ~80% of page
+# bytes. Blocked unless a screenshot was requested.
+_BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+
+async def _block_heavy_resources(route):
+    """Abort requests for heavyweight resources, let the rest through."""
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def visit_website(url: str, take_screenshot: bool = False,
+                        defer_record: bool = False) -> Tuple[bool, float, str, Optional[str]]:
     """
     Visit a website using Playwright browser.
-    
+
     Args:
         url: The URL to visit
         take_screenshot: Whether to capture a screenshot
-    
+        defer_record: Skip saving the visit record (caller batches it)
+
     Returns:
-        Tuple of (success, response_time_ms, error_message, screenshot_bytes)
+        Tuple of (success, response_time_ms, error_message, screenshot_key)
     """
     if not PLAYWRIGHT_AVAILABLE:
         return False, 0, "Playwright not installed", None
-    
+
     start_time = time.time()
-    screenshot_bytes = None
-    
+    screenshot_key = None
+    page = None
+
     try:
-        async with async_playwright() as p:
-            # Launch browser in headless mode
-            browser = await p.chromium.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu']
-            )
-            
-            # Create a new context with realistic viewport
-            context = await browser.new_context(
-                viewport={'width': 1280, 'height': 720},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36'
-            )
-            
-            page = await context.new_page()
-            
-            # Navigate to URL with timeout
-            await page.goto(url, wait_until='networkidle', timeout=60000)
-            
-            # Wait 20-30 seconds for content to fully load (especially for SPAs)
-            import random
-            wait_time = random.randint(20, 30)
-            await asyncio.sleep(wait_time)
-            
-            response_time = (time.time() - start_time) * 1000
-            
-            # Take screenshot as bytes (not file)
-            if take_screenshot:
-                screenshot_bytes = await page.screenshot(type='png')
-            
-            await browser.close()
-            
-            # Record successful visit (without screenshot path since we use bytes now)
+        context = await _get_browser_context()
+        page = await context.new_page()
+
+        # Skip images/fonts/media unless we need a faithful screenshot;
+        # routed per page so the shared context stays clean
+        if not take_screenshot:
+            await page.route("**/*", _block_heavy_resources)
+
+        # Navigate to URL with timeout; 'load' is enough to wake the
+        # origin, no need to idle-wait or pad with a sleep afterwards
+        await page.goto(url, wait_until='load', timeout=15000)
+
+        response_time = (time.time() - start_time) * 1000
+
+        # JPEG at quality 60 is 5-10x smaller than PNG for this purpose
+        if take_screenshot:
+            image = await page.screenshot(type='jpeg', quality=60, full_page=False)
+            screenshot_key = _store_screenshot(image)
+
+        # Record successful visit (screenshots live in the in-memory cache)
+        if not defer_record:
             add_visit_record(url, True, response_time, "", "")
-            
-            return True, response_time, "", screenshot_bytes
-            
+
+        return True, response_time, "", screenshot_key
+
     except PlaywrightTimeout:
         response_time = (time.time() - start_time) * 1000
         error_msg = "Timeout: Page took too long to load"
-        add_visit_record(url, False, response_time, error_msg)
+        if not defer_record:
+            add_visit_record(url, False, response_time, error_msg)
         return False, response_time, error_msg, None
-        
+
     except Exception as e:
         response_time = (time.time() - start_time) * 1000
+        # If the browser itself died (not just this page), discard the
+        # shared context so the next visit relaunches instead of failing
+        # with "target closed" until the process restarts
+        if any(s in str(e) for s in _CLOSED_BROWSER_ERRORS):
+            await _discard_dead_context()
         error_msg = str(e)[:200]  # Limit error message length
-        add_visit_record(url, False, response_time, error_msg)
+        if not defer_record:
+            add_visit_record(url, False, response_time, error_msg)
         return False, response_time, error_msg, None
 
+    finally:
+        # Close only the page; the shared context stays alive for reuse
+        if page is not None:
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+
+async def visit_website_http(url: str, defer_record: bool = False) -> Tuple[bool, float, str, Optional[str]]:
+    """
+    Visit a website with a plain HTTP GET instead of a full browser render.
+
+    Waking a sleeping free-tier app only needs a request to reach the
+    origin; this costs milliseconds and <1MB vs. a ~300MB Chromium render.
+
+    Returns:
+        Tuple of (success, response_time_ms, error_message, None)
+    """
+    if not HTTPX_AVAILABLE:
+        return False, 0, "httpx not installed", None
+
+    start_time = time.time()
+
+    try:
+        response = await _get_client().get(url)
+        response_time = (time.time() - start_time) * 1000
+
+        if response.status_code < 400:
+            if not defer_record:
+                add_visit_record(url, True, response_time, "", "")
+            return True, response_time, "", None
 
-def visit_website_sync(url: str, take_screenshot: bool = False) -> Tuple[bool, float, str, Optional[bytes]]:
+        error_msg = f"HTTP {response.status_code}"
+        if not defer_record:
+            add_visit_record(url, False, response_time, error_msg)
+        return False, response_time, error_msg, None
+
+    except Exception as e:
+        response_time = (time.time() - start_time) * 1000
+        error_msg = str(e)[:200]
+        if not defer_record:
+            add_visit_record(url, False, response_time, error_msg)
+        return False, response_time, error_msg, None
+
+
+def visit_website_sync(url: str, take_screenshot: bool = False) -> Tuple[bool, float, str, Optional[str]]:
     """Synchronous wrapper for visit_website."""
-    return asyncio.run(visit_website(url, take_screenshot))
+    return asyncio.run_coroutine_threadsafe(visit_website(url, take_screenshot), _loop).result()
+
+
+async def _visit_one(site: dict, take_screenshot: bool, sem: asyncio.Semaphore) -> dict:
+    """Visit a single site under the concurrency semaphore."""
+    async with sem:
+        # Default to the cheap HTTP GET; only spin up Chromium when the
+        # site needs JS to wake up or a screenshot was requested
+        if site.get("requires_browser") or take_screenshot:
+            success, response_time, error, screenshot = await visit_website(
+                site["url"],
+                take_screenshot,
+                defer_record=True
+            )
+        else:
+            success, response_time, error, screenshot = await visit_website_http(
+                site["url"],
+                defer_record=True
+            )
+    return {
+        "url": site["url"],
+        "name": site.get("name", site["url"]),
+        "success": success,
+        "response_time_ms": response_time,
+        "error": error,
+        "screenshot": screenshot  # cache key or None
+    }
 
 
 async def visit_all_websites(websites: list) -> list:
-    """Visit all enabled websites."""
+    """Visit websites concurrently, each on its own page.
+
+    Callers (app and scheduler) pass only enabled sites, so no
+    re-filtering happens here.
+    """
+    if not websites:
+        return []
+
     settings = get_settings()
     take_screenshots = settings.get("screenshots_enabled", False)
-    
+
+    # Bound concurrency so we don't open too many pages at once
+    sem = asyncio.Semaphore(int(os.environ.get("KMA_CONCURRENCY", "5")))
+
+    raw = await asyncio.gather(
+        *(_visit_one(site, take_screenshots, sem) for site in websites),
+        return_exceptions=True
+    )
+
     results = []
-    for site in websites:
-        if site.get("enabled", True):
-            success, response_time, error, screenshot = await visit_website(
-                site["url"], 
-                take_screenshots
-            )
+    for site, result in zip(websites, raw):
+        if isinstance(result, BaseException):
             results.append({
                 "url": site["url"],
                 "name": site.get("name", site["url"]),
-                "success": success,
-                "response_time_ms": response_time,
-                "error": error,
-                "screenshot": screenshot  # bytes or None
+                "success": False,
+                "response_time_ms": 0,
+                "error": str(result)[:200],
+                "screenshot": None
             })
-    
+        else:
+            results.append(result)
+
+    # Flush all visit records in one save instead of one Gist write each
+    add_visit_records_bulk([
+        make_visit_record(r["url"], r["success"], r["response_time_ms"], r["error"])
+        for r in results
+    ])
+
     return results
 
 
 def visit_all_websites_sync(websites: list) -> list:
     """Synchronous wrapper for visit_all_websites."""
-    return asyncio.run(visit_all_websites(websites))
+    return asyncio.run_coroutine_threadsafe(visit_all_websites(websites), _loop).result()
 
 
 def check_playwright_installed() -> bool:
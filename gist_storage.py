@@ -2,13 +2,48 @@
 GitHub Gist storage module for Keep Me Alive service.
 Provides persistent storage using GitHub Gist API.
 """
+import atexit
+import copy
+import logging
 import os
 import json
+import time
 import requests
+from hashlib import blake2b
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from typing import Optional
 import threading
 
+# Prefer orjson for (de)serialization: C-speed and compact output
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _dumps(data: dict) -> str:
+    """Serialize data compactly (no indent) for the Gist payload."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, default=str)
+
+
+def _dumps_bytes(data: dict) -> bytes:
+    """Serialize data compactly to bytes (the queued payload format)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data)
+    return json.dumps(data, default=str).encode("utf-8")
+
+
+def _loads(content: str) -> dict:
+    """Deserialize a Gist file's content."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(content)
+    return json.loads(content)
+
 # Environment variables
 GIST_TOKEN = os.environ.get("GIST_TOKEN", "")
 GIST_ID = os.environ.get("GIST_ID", "")
@@ -20,6 +55,12 @@ GIST_API_URL = "https://api.github.com/gists"
 # Thread lock for API operations
 _api_lock = threading.Lock()
 
+# logging.exception defers formatting until a handler actually emits,
+# unlike the old print(f"...") calls which always built the string
+logger = logging.getLogger(__name__)
+if os.environ.get("KMA_LOG_LEVEL"):
+    logger.setLevel(os.environ["KMA_LOG_LEVEL"])
+
 # Default data structure
 DEFAULT_DATA = {
     "websites": [],
@@ -32,6 +73,20 @@ DEFAULT_DATA = {
 }
 
 
+def fresh_default_data() -> dict:
+    """
+    Build a new default data structure with no shared containers.
+
+    A shallow DEFAULT_DATA.copy() aliases the module-level lists, so any
+    append through the copy would silently mutate the defaults forever.
+    """
+    return {
+        "websites": [],
+        "settings": dict(DEFAULT_DATA["settings"]),
+        "visit_history": []
+    }
+
+
 def _get_headers() -> dict:
     """Get API headers with authentication."""
     return {
@@ -40,72 +95,232 @@ def _get_headers() -> dict:
     }
 
 
+# One session for all Gist calls: reuses the TLS connection to
+# api.github.com via keepalive (saves ~150ms handshake per call) and
+# retries transient gateway errors with exponential backoff
+_session = requests.Session()
+_session.headers.update(_get_headers())
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+))
+
+
 def is_gist_configured() -> bool:
     """Check if Gist storage is properly configured."""
     return bool(GIST_TOKEN and GIST_ID)
 
 
+# Conditional-request cache: GitHub returns 304 (no body, no rate-limit
+# cost) when the Gist hasn't changed since the cached ETag
+_etag: Optional[str] = None
+_cached: Optional[dict] = None
+_cached_at: float = 0.0
+CACHE_TTL_SECONDS = 2.0
+
+# Negative cache: after a failed load, don't retry the API for a while,
+# or every read during a GitHub outage eats a 10s timeout
+_last_load_error_at: float = 0.0
+LOAD_ERROR_BACKOFF_SECONDS = 60.0
+
+
 def load_from_gist() -> dict:
     """Load data from GitHub Gist."""
+    global _etag, _cached, _cached_at, _last_load_error_at
+
     if not is_gist_configured():
-        return DEFAULT_DATA.copy()
-    
+        return fresh_default_data()
+
+    if time.monotonic() - _last_load_error_at < LOAD_ERROR_BACKOFF_SECONDS:
+        return copy.deepcopy(_cached) if _cached is not None else fresh_default_data()
+
     try:
         with _api_lock:
-            response = requests.get(
+            # Serve straight from cache for a short window so Streamlit
+            # reruns don't re-issue even the conditional request
+            if _cached is not None and time.monotonic() - _cached_at < CACHE_TTL_SECONDS:
+                return copy.deepcopy(_cached)
+
+            # Session carries auth headers; only the ETag varies per call
+            headers = {"If-None-Match": _etag} if _etag else None
+
+            response = _session.get(
                 f"{GIST_API_URL}/{GIST_ID}",
-                headers=_get_headers(),
+                headers=headers,
                 timeout=10
             )
-            
+
+            if response.status_code == 304 and _cached is not None:
+                _cached_at = time.monotonic()
+                return copy.deepcopy(_cached)
+
             if response.status_code == 200:
                 gist_data = response.json()
                 files = gist_data.get("files", {})
-                
+
                 if GIST_FILENAME in files:
                     content = files[GIST_FILENAME].get("content", "{}")
-                    data = json.loads(content)
-                    # Ensure all required keys exist
-                    for key in DEFAULT_DATA:
-                        if key not in data:
-                            data[key] = DEFAULT_DATA[key]
+                    data = _loads(content)
+                    # Ensure all required keys exist (single C-level
+                    # merge). Fill from fresh containers, not
+                    # DEFAULT_DATA: storage mutates the loaded blob in
+                    # place, and aliased default lists would be
+                    # corrupted module-wide
+                    data = {**fresh_default_data(), **data}
+                    data["settings"] = {**DEFAULT_DATA["settings"], **data.get("settings", {})}
+                    _etag = response.headers.get("ETag")
+                    _cached = copy.deepcopy(data)
+                    _cached_at = time.monotonic()
                     return data
-            
-            return DEFAULT_DATA.copy()
-            
-    except Exception as e:
-        print(f"Error loading from Gist: {e}")
-        return DEFAULT_DATA.copy()
 
+            return fresh_default_data()
+
+    except Exception:
+        logger.exception("Failed to load from Gist")
+        _last_load_error_at = time.monotonic()
+        # Serve the last good payload, same as the backoff branch: a
+        # transient error must not hand callers an empty blob they might
+        # cache and later write back over the real data
+        return copy.deepcopy(_cached) if _cached is not None else fresh_default_data()
+
+
+# Debounced write-back: save_to_gist only queues the payload; a single
+# daemon thread flushes it, coalescing bursts of writes (e.g. a sweep's
+# records plus a settings change) into one PATCH per FLUSH_INTERVAL.
+# Payloads are queued pre-serialized so toggle+untoggle or no-op settings
+# saves produce byte-identical buffers the hash gate can drop outright.
+FLUSH_INTERVAL_SECONDS = 2.0
+_pending: Optional[bytes] = None
+_pending_lock = threading.Lock()
+_dirty = threading.Event()
+_last_flush = 0.0
+_flusher_started = False
+
+# Hash of the last payload successfully uploaded; a matching queued
+# payload means the Gist is already up to date, so skip the PATCH
+_last_gist_hash: Optional[bytes] = None
+
+
+def _push_to_gist(buf: bytes) -> bool:
+    """Synchronously PATCH a serialized payload to the Gist."""
+    global _etag, _cached_at, _last_gist_hash
+
+    payload_hash = blake2b(buf, digest_size=8).digest()
+    if payload_hash == _last_gist_hash:
+        return True
 
-def save_to_gist(data: dict) -> bool:
-    """Save data to GitHub Gist."""
-    if not is_gist_configured():
-        return False
-    
     try:
         with _api_lock:
             payload = {
                 "files": {
                     GIST_FILENAME: {
-                        "content": json.dumps(data, indent=2, default=str)
+                        "content": buf.decode("utf-8")
                     }
                 }
             }
-            
-            response = requests.patch(
+
+            response = _session.patch(
                 f"{GIST_API_URL}/{GIST_ID}",
-                headers=_get_headers(),
                 json=payload,
                 timeout=10
             )
-            
-            return response.status_code == 200
-            
-    except Exception as e:
-        print(f"Error saving to Gist: {e}")
+
+            if response.status_code == 200:
+                # The read cache was written through at queue time; just
+                # refresh the conditional-request state
+                _etag = response.headers.get("ETag")
+                _cached_at = time.monotonic()
+                _last_gist_hash = payload_hash
+                return True
+
+            logger.error("Failed to save to Gist: HTTP %s", response.status_code)
+            return False
+
+    except Exception:
+        logger.exception("Failed to save to Gist")
+        return False
+
+
+def _flush_loop():
+    """Flush queued payloads, at most one PATCH per FLUSH_INTERVAL."""
+    global _pending, _last_flush
+
+    while True:
+        _dirty.wait()
+
+        # Debounce so rapid successive saves coalesce into one PATCH
+        delay = FLUSH_INTERVAL_SECONDS - (time.monotonic() - _last_flush)
+        if delay > 0:
+            time.sleep(delay)
+
+        with _pending_lock:
+            buf = _pending
+            _pending = None
+            _dirty.clear()
+
+        if buf is not None:
+            if not _push_to_gist(buf):
+                # Re-queue the payload so the next interval retries,
+                # unless a newer one arrived while we were uploading
+                with _pending_lock:
+                    if _pending is None:
+                        _pending = buf
+                    _dirty.set()
+            _last_flush = time.monotonic()
+
+
+def _ensure_flusher():
+    """Start the background flusher thread once."""
+    global _flusher_started
+    if not _flusher_started:
+        _flusher_started = True
+        threading.Thread(target=_flush_loop, daemon=True, name="gist-flusher").start()
+
+
+def flush_gist_now() -> bool:
+    """Synchronously push any queued payload (e.g. on shutdown)."""
+    with _pending_lock:
+        buf = _pending
+
+    if buf is None:
+        return True
+    return _push_to_gist(buf)
+
+
+atexit.register(flush_gist_now)
+
+
+def save_to_gist_bytes(buf: bytes, data: Optional[dict] = None) -> bool:
+    """Queue a pre-serialized payload for the background Gist flush.
+
+    Callers that already hold the serialized bytes (storage writes the
+    same buffer to disk) pass them here so the data is never dumped
+    twice. `data` is an optional already-parsed copy for the read cache;
+    without it the buffer is parsed once instead.
+    """
+    global _pending, _cached, _cached_at
+
+    if not is_gist_configured():
         return False
 
+    _ensure_flusher()
+
+    with _pending_lock:
+        _pending = buf
+        # Write through to the read cache so reads see the new state
+        # immediately, before the PATCH lands
+        _cached = copy.deepcopy(data) if data is not None else _loads(buf)
+        _cached_at = time.monotonic()
+
+    _dirty.set()
+    return True
+
+
+def save_to_gist(data: dict) -> bool:
+    """Serialize and queue data for the Gist flush. True if queued."""
+    return save_to_gist_bytes(_dumps_bytes(data), data)
+
 
 def create_gist() -> Optional[str]:
     """Create a new Gist and return its ID. Requires only GIST_TOKEN."""
@@ -118,14 +333,13 @@ def create_gist() -> Optional[str]:
             "public": False,
             "files": {
                 GIST_FILENAME: {
-                    "content": json.dumps(DEFAULT_DATA, indent=2)
+                    "content": _dumps(DEFAULT_DATA)
                 }
             }
         }
         
-        response = requests.post(
+        response = _session.post(
             GIST_API_URL,
-            headers=_get_headers(),
             json=payload,
             timeout=10
         )
@@ -135,6 +349,6 @@ def create_gist() -> Optional[str]:
         
         return None
         
-    except Exception as e:
-        print(f"Error creating Gist: {e}")
+    except Exception:
+        logger.exception("Failed to create Gist")
         return None
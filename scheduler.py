@@ -5,13 +5,15 @@ Uses APScheduler for background cron-like job scheduling.
 import random
 import threading
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Callable, Optional
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.base import JobLookupError
 
-from storage import get_settings, get_websites
+from storage import get_settings, get_settings_version, get_enabled_websites
 from browser_worker import visit_all_websites_sync
 
 # Configure logging
@@ -26,9 +28,26 @@ _next_run_time: Optional[datetime] = None
 _is_running = False
 
 
+# Settings snapshot, re-fetched only when storage's version counter
+# moves — reschedules happen every run but settings rarely change
+_settings_cache: Optional[dict] = None
+_settings_cache_version = -1
+
+
+def _get_cached_settings() -> dict:
+    """Get settings, reloading only when the stored version changed."""
+    global _settings_cache, _settings_cache_version
+
+    version = get_settings_version()
+    if _settings_cache is None or version != _settings_cache_version:
+        _settings_cache = get_settings()
+        _settings_cache_version = version
+    return _settings_cache
+
+
 def _get_random_interval() -> int:
     """Get a random interval within configured range."""
-    settings = get_settings()
+    settings = _get_cached_settings()
     min_interval = settings.get("interval_min", 10)
     max_interval = settings.get("interval_max", 14)
     return random.randint(min_interval, max_interval)
@@ -42,9 +61,8 @@ def _run_visits():
     _last_run_time = datetime.now()
     
     try:
-        websites = get_websites()
-        enabled_sites = [w for w in websites if w.get("enabled", True)]
-        
+        enabled_sites = get_enabled_websites()
+
         if enabled_sites:
             logger.info(f"Running scheduled visits for {len(enabled_sites)} websites")
             results = visit_all_websites_sync(enabled_sites)
@@ -70,28 +88,28 @@ def _reschedule_with_random_interval():
         return
     
     try:
-        # Remove existing job if present
-        existing_jobs = _scheduler.get_jobs()
-        for job in existing_jobs:
-            if job.id == "keep_alive_job":
-                _scheduler.remove_job("keep_alive_job")
-                break
-        
-        # Add job with new random interval
         interval_minutes = _get_random_interval()
         _next_run_time = datetime.now() + timedelta(minutes=interval_minutes)
-        
-        _scheduler.add_job(
-            _run_visits,
-            trigger=IntervalTrigger(minutes=interval_minutes),
-            id="keep_alive_job",
-            name="Keep Alive Website Visits",
-            replace_existing=True,
-            next_run_time=_next_run_time
-        )
-        
+
+        try:
+            # Update the existing job in place: one jobstore lock
+            # acquisition, no job-list scan or trigger-state rebuild
+            _scheduler.reschedule_job(
+                "keep_alive_job",
+                trigger=IntervalTrigger(minutes=interval_minutes)
+            )
+            _scheduler.modify_job("keep_alive_job", next_run_time=_next_run_time)
+        except JobLookupError:
+            _scheduler.add_job(
+                _run_visits,
+                trigger=IntervalTrigger(minutes=interval_minutes),
+                id="keep_alive_job",
+                name="Keep Alive Website Visits",
+                next_run_time=_next_run_time
+            )
+
         logger.info(f"Next visit scheduled in {interval_minutes} minutes")
-        
+
     except Exception as e:
         logger.error(f"Error rescheduling: {e}")
 
@@ -164,15 +182,19 @@ def get_scheduler_status() -> dict:
     }
 
 
+# One reused worker for manual triggers instead of a fresh Thread per
+# click; the future doubles as the in-progress check
+_manual_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keepalive-manual")
+_manual_future: Optional[Future] = None
+
+
 def trigger_immediate_run():
     """Trigger an immediate visit run (manual trigger)."""
-    global _is_running
-    
-    if _is_running:
+    global _manual_future
+
+    if _is_running or (_manual_future is not None and not _manual_future.done()):
         logger.warning("A visit run is already in progress")
         return False
-    
-    # Run in a separate thread to not block
-    thread = threading.Thread(target=_run_visits, daemon=True)
-    thread.start()
+
+    _manual_future = _manual_pool.submit(_run_visits)
     return True
@@ -4,20 +4,61 @@ Uses GitHub Gist for persistence (cloud) with local fallback.
 Auto-cleans history older than 3 days.
 """
 import json
+import logging
 import os
-from datetime import datetime, timedelta
+import secrets
+import time
+from datetime import datetime
 from pathlib import Path
 from typing import Optional
 import threading
 
+# Prefer orjson for the local file: C-speed and one buffered write
+# instead of stdlib json.dump's many small fp.write calls
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from gist_storage import (
-    is_gist_configured, load_from_gist, save_to_gist, DEFAULT_DATA
+    is_gist_configured, load_from_gist, save_to_gist_bytes, DEFAULT_DATA,
+    fresh_default_data
 )
 
+logger = logging.getLogger(__name__)
+if os.environ.get("KMA_LOG_LEVEL"):
+    logger.setLevel(os.environ["KMA_LOG_LEVEL"])
+
+
+def _dump_bytes(data: dict) -> bytes:
+    """Serialize the data blob for the local file (compact, no indent)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data)
+    return json.dumps(data, default=str).encode("utf-8")
+
+
+def _load_bytes(raw: bytes) -> dict:
+    """Deserialize the local file's contents."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _dump_line(record: dict) -> bytes:
+    """Serialize one history record as a JSON line."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, default=str) + "\n").encode("utf-8")
+
 # Local fallback path
 DATA_DIR = Path(__file__).parent / "data"
 DATA_FILE = DATA_DIR / "websites.json"
 
+# Visit history lives in its own JSON-lines file so each record is an
+# O(1) append instead of a rewrite of the whole data blob
+HISTORY_FILE = DATA_DIR / "history.jsonl"
+
 # Thread lock for operations
 _data_lock = threading.Lock()
 
@@ -25,211 +66,439 @@ _data_lock = threading.Lock()
 _cache: Optional[dict] = None
 _cache_loaded = False
 
+# Position indexes over the cached website list so mutators look up by
+# id/url in O(1) instead of scanning; rebuilt on every load and save.
+# The enabled-sites list is precomputed here too, so the scheduler's
+# per-tick read is a plain attribute fetch.
+_id_pos: dict = {}
+_url_pos: dict = {}
+_enabled_cache: list = []
+
+
+def _rebuild_indexes(websites: list):
+    """Rebuild the id/url position maps and the enabled-sites list."""
+    global _id_pos, _url_pos, _enabled_cache
+    _id_pos = {w["id"]: i for i, w in enumerate(websites)}
+    _url_pos = {w["url"].lower(): i for i, w in enumerate(websites)}
+    _enabled_cache = [w for w in websites if w.get("enabled", True)]
+
 
 def _ensure_local_file():
     """Ensure local data directory and file exist."""
     DATA_DIR.mkdir(exist_ok=True)
     if not DATA_FILE.exists():
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(DEFAULT_DATA, f, indent=2)
+        DATA_FILE.write_bytes(_dump_bytes(DEFAULT_DATA))
 
 
-def _load_data() -> dict:
-    """Load data from Gist (primary) or local file (fallback)."""
+def _load_data_locked() -> dict:
+    """Load the blob into the cache if needed. Caller holds _data_lock."""
     global _cache, _cache_loaded
-    
-    with _data_lock:
-        # Return cache if already loaded
-        if _cache_loaded and _cache is not None:
-            return _cache.copy()
-        
-        # Try Gist first
-        if is_gist_configured():
-            data = load_from_gist()
-            if data:
-                _cache = data
-                _cache_loaded = True
-                return data.copy()
-        
-        # Fallback to local file
-        _ensure_local_file()
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                _cache = data
-                _cache_loaded = True
-                return data.copy()
-        except Exception:
-            _cache = DEFAULT_DATA.copy()
+
+    # Return cache if already loaded
+    if _cache_loaded and _cache is not None:
+        return _cache
+
+    # Try Gist first
+    if is_gist_configured():
+        data = load_from_gist()
+        if data:
+            _cache = data
             _cache_loaded = True
-            return DEFAULT_DATA.copy()
+            _rebuild_indexes(_cache.get("websites", []))
+            _seed_history_file(_cache.get("visit_history", []))
+            return _cache
+
+    # Fallback to local file
+    _ensure_local_file()
+    try:
+        _cache = _load_bytes(DATA_FILE.read_bytes())
+    except FileNotFoundError:
+        _cache = fresh_default_data()
+    except ValueError:
+        # Corrupt JSON (orjson and stdlib decode errors are ValueErrors):
+        # keep the bad bytes for inspection instead of silently eating
+        # them, then start from defaults
+        corrupt = DATA_FILE.with_suffix(".json.corrupt")
+        try:
+            os.replace(DATA_FILE, corrupt)
+            logger.warning("Corrupt data file backed up to %s", corrupt)
+        except OSError:
+            pass
+        _cache = fresh_default_data()
+    except OSError:
+        logger.exception("Error reading local file")
+        _cache = fresh_default_data()
+    _cache_loaded = True
+    _rebuild_indexes(_cache.get("websites", []))
+    _seed_history_file(_cache.get("visit_history", []))
+    return _cache
+
+
+def _load_data_readonly() -> dict:
+    """Get the cached blob itself. Callers must not mutate it.
+
+    Readers hit this on every Streamlit rerun and scheduler tick; handing
+    out the cache directly avoids a copy per call.
+    """
+    with _data_lock:
+        return _load_data_locked()
+
+
+# Hash of the last bytes written locally, to skip byte-identical rewrites
+_last_written_hash: Optional[int] = None
 
 
-def _save_data(data: dict):
-    """Save data to Gist (primary) and local file (backup)."""
-    global _cache
-    
+def _persist_locked(data: dict) -> Optional[bytes]:
+    """Write data to the local file. Caller holds _data_lock.
+
+    Returns the serialized buffer (or None if serialization failed) so
+    the Gist upload can reuse it instead of dumping the dict again.
+    """
+    global _last_written_hash
+
+    # Save local backup, atomically and only when the bytes changed
+    DATA_DIR.mkdir(exist_ok=True)
+    buf = None
+    try:
+        buf = _dump_bytes(data)
+        buf_hash = hash(buf)
+        if buf_hash != _last_written_hash:
+            # Write-then-rename so a crash mid-write can't corrupt
+            # the data file
+            tmp = DATA_FILE.with_suffix(".json.tmp")
+            tmp.write_bytes(buf)
+            os.replace(tmp, DATA_FILE)
+            _last_written_hash = buf_hash
+    except Exception:
+        logger.exception("Error saving local file")
+    return buf
+
+
+def _mutate(fn):
+    """Apply fn to the cached blob and persist, in one critical section.
+
+    fn receives the cache itself, so a mutation costs one lock
+    acquisition and zero dict copies. Returns whatever fn returns.
+    """
     with _data_lock:
-        _cache = data.copy()
-        
-        # Save to Gist if configured
-        if is_gist_configured():
-            save_to_gist(data)
-        
-        # Always save local backup
-        _ensure_local_file()
-        try:
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, default=str)
-        except Exception as e:
-            print(f"Error saving local file: {e}")
+        data = _load_data_locked()
+        result = fn(data)
+        _rebuild_indexes(data.get("websites", []))
+        buf = _persist_locked(data)
+
+    # Queue the Gist write outside the lock, reusing the buffer the
+    # local write just produced — one serialize pass feeds both sinks.
+    # save_to_gist_bytes only snapshots the payload for gist_storage's
+    # debounced flusher, so callers never block on (or hold _data_lock
+    # across) the network round-trip. Only the immutable buffer crosses
+    # the lock boundary: handing over the live cache dict would let
+    # gist_storage deepcopy it while another mutator is resizing it
+    if buf is not None and is_gist_configured():
+        save_to_gist_bytes(buf)
+
+    return result
 
 
 def refresh_cache():
     """Force reload data from Gist."""
-    global _cache, _cache_loaded
+    global _cache, _cache_loaded, _settings_version
     with _data_lock:
         _cache = None
         _cache_loaded = False
-    _load_data()
+        _load_data_locked()
+    # A refresh may have pulled different settings from the Gist
+    _settings_version += 1
 
 
 # Website management functions
 def get_websites() -> list:
     """Get all websites from storage."""
-    data = _load_data()
+    data = _load_data_readonly()
     return data.get("websites", [])
 
 
+def get_enabled_websites() -> list:
+    """Get only the enabled websites, precomputed at mutation time."""
+    _load_data_readonly()  # Make sure the cache (and the list) is built
+    return _enabled_cache
+
+
 def add_website(url: str, name: str = "") -> bool:
     """Add a website to the list. Returns True if added, False if already exists."""
-    data = _load_data()
-    
-    # Check if URL already exists
-    for site in data["websites"]:
-        if site["url"].lower() == url.lower():
+    url_lower = url.lower()
+
+    def mutator(data):
+        # Check if URL already exists
+        if url_lower in _url_pos:
             return False
-    
-    # Add new website
-    website = {
-        "id": datetime.now().strftime("%Y%m%d%H%M%S%f"),
-        "url": url,
-        "name": name or url,
-        "enabled": True,
-        "added_at": datetime.now().isoformat()
-    }
-    data["websites"].append(website)
-    _save_data(data)
-    return True
+
+        # Add new website; hex time_ns plus random suffix can't collide
+        # on rapid adds the way the old strftime-based id could
+        data["websites"].append({
+            "id": f"{time.time_ns():x}{secrets.token_hex(3)}",
+            "url": url,
+            "name": name or url,
+            "enabled": True,
+            "added_at": datetime.now().isoformat()
+        })
+        return True
+
+    return _mutate(mutator)
 
 
 def remove_website(website_id: str) -> bool:
     """Remove a website by ID. Returns True if removed."""
-    data = _load_data()
-    original_count = len(data["websites"])
-    data["websites"] = [w for w in data["websites"] if w["id"] != website_id]
-    
-    if len(data["websites"]) < original_count:
-        _save_data(data)
+    def mutator(data):
+        pos = _id_pos.get(website_id)
+        if pos is None:
+            return False
+        data["websites"].pop(pos)
         return True
-    return False
+
+    return _mutate(mutator)
 
 
 def toggle_website(website_id: str) -> bool:
     """Toggle a website's enabled status. Returns new status."""
-    data = _load_data()
-    for website in data["websites"]:
-        if website["id"] == website_id:
-            website["enabled"] = not website["enabled"]
-            _save_data(data)
-            return website["enabled"]
-    return False
+    def mutator(data):
+        pos = _id_pos.get(website_id)
+        if pos is None:
+            return False
+        website = data["websites"][pos]
+        website["enabled"] = not website["enabled"]
+        return website["enabled"]
+
+    return _mutate(mutator)
 
 
 # Settings management functions
+
+# Bumped on every settings change (and full cache refresh) so callers
+# can keep their own settings snapshot and re-fetch only on mismatch
+_settings_version = 0
+
+
+def get_settings_version() -> int:
+    """Get the monotonic settings version counter."""
+    return _settings_version
+
+
 def get_settings() -> dict:
     """Get current settings."""
-    data = _load_data()
-    return data.get("settings", DEFAULT_DATA["settings"].copy())
+    data = _load_data_readonly()
+    return data.get("settings", dict(DEFAULT_DATA["settings"]))
 
 
 def update_settings(interval_min: int = None, interval_max: int = None, 
                    screenshots_enabled: bool = None):
     """Update settings. Only updates provided values."""
-    data = _load_data()
-    settings = data.get("settings", DEFAULT_DATA["settings"].copy())
-    
-    if interval_min is not None:
-        settings["interval_min"] = interval_min
-    if interval_max is not None:
-        settings["interval_max"] = interval_max
-    if screenshots_enabled is not None:
-        settings["screenshots_enabled"] = screenshots_enabled
-    
-    data["settings"] = settings
-    _save_data(data)
+    def mutator(data):
+        settings = data.get("settings", dict(DEFAULT_DATA["settings"]))
+
+        if interval_min is not None:
+            settings["interval_min"] = interval_min
+        if interval_max is not None:
+            settings["interval_max"] = interval_max
+        if screenshots_enabled is not None:
+            settings["screenshots_enabled"] = screenshots_enabled
+
+        data["settings"] = settings
+
+    _mutate(mutator)
+
+    global _settings_version
+    _settings_version += 1
 
 
 # Visit history functions
 HISTORY_MAX_AGE_DAYS = 3  # Auto-cleanup entries older than this
 
+# Hard cap on history length so the serialized payload (and every Gist
+# write) stays bounded no matter how often visits run
+MAX_HISTORY = int(os.environ.get("KMA_MAX_HISTORY", "500"))
+
+
+def _record_ts(record: dict) -> float:
+    """Get a record's epoch timestamp, parsing the ISO string only for
+    records written before the numeric timestamp field existed."""
+    ts = record.get("t", record.get("ts"))
+    if ts is not None:
+        return ts
+    try:
+        return datetime.fromisoformat(record.get("timestamp", "")).timestamp()
+    except (ValueError, TypeError):
+        # Keep records with invalid timestamps (shouldn't happen)
+        return float("inf")
+
+
+def _compact_record(record: dict) -> dict:
+    """Translate a legacy long-key visit record to the compact schema.
+
+    Compact keys: t (epoch seconds), u (url), ok (success), rt
+    (response_time_ms), e (error_message). The long keys were ~5x the
+    bytes per record, and history dominates the Gist payload.
+    """
+    if "t" in record:
+        return record
+    return {
+        "t": _record_ts(record),
+        "u": record.get("url", ""),
+        "ok": record.get("success", False),
+        "rt": record.get("response_time_ms", 0),
+        "e": record.get("error_message", "")
+    }
+
 
 def _cleanup_old_history(history: list) -> list:
     """Remove history entries older than HISTORY_MAX_AGE_DAYS."""
     if not history:
         return []
-    
-    cutoff = datetime.now() - timedelta(days=HISTORY_MAX_AGE_DAYS)
-    cleaned = []
-    
-    for record in history:
-        try:
-            timestamp = datetime.fromisoformat(record.get("timestamp", ""))
-            if timestamp > cutoff:
-                cleaned.append(record)
-        except (ValueError, TypeError):
-            # Keep records with invalid timestamps (shouldn't happen)
-            cleaned.append(record)
-    
-    return cleaned
+
+    cutoff = time.time() - HISTORY_MAX_AGE_DAYS * 86400
+
+    # History is newest-first: if the oldest record is still fresh,
+    # nothing can be stale
+    if _record_ts(history[-1]) > cutoff:
+        return history
+
+    # Same invariant the other way: everything from the first stale
+    # record onward is at least as old, so slice instead of filtering
+    for i, record in enumerate(history):
+        if _record_ts(record) <= cutoff:
+            return history[:i]
+    return history
+
+
+def make_visit_record(url: str, success: bool, response_time: float = 0,
+                      error_message: str = "") -> dict:
+    """Build a visit record dict (compact schema) without saving it."""
+    return {
+        "t": round(time.time(), 3),
+        "u": url,
+        "ok": success,
+        "rt": round(response_time, 2),
+        "e": error_message
+    }
 
 
-def add_visit_record(url: str, success: bool, response_time: float = 0, 
+# Lock for the history file; cleanup/Gist sync runs at most hourly so
+# the insert path stays a bare append
+_history_lock = threading.Lock()
+_last_history_sync = 0.0
+HISTORY_SYNC_INTERVAL_SECONDS = 3600
+
+
+def add_visit_record(url: str, success: bool, response_time: float = 0,
                      error_message: str = "", screenshot_path: str = ""):
-    """Add a visit record to history and auto-cleanup old entries."""
-    data = _load_data()
-    
-    record = {
-        "url": url,
-        "timestamp": datetime.now().isoformat(),
-        "success": success,
-        "response_time_ms": round(response_time, 2),
-        "error_message": error_message
-    }
-    
-    # Get history and cleanup old entries
-    history = data.get("visit_history", [])
-    history = _cleanup_old_history(history)
-    
-    # Add new record at beginning
-    history.insert(0, record)
-    
-    # Also limit to max 100 entries as safety
-    data["visit_history"] = history[:100]
-    
-    _save_data(data)
+    """Add a visit record to history."""
+    add_visit_records_bulk([make_visit_record(url, success, response_time, error_message)])
+
+
+def add_visit_records_bulk(records: list):
+    """Append visit records to the history log (O(1) per record)."""
+    if not records:
+        return
+
+    lines = b"".join(_dump_line(record) for record in records)
+
+    with _history_lock:
+        DATA_DIR.mkdir(exist_ok=True)
+        with open(HISTORY_FILE, "ab") as f:
+            f.write(lines)
+
+    _maybe_sync_history()
+
+
+def _seed_history_file(history: list):
+    """Seed the history log from blob records when the log is empty.
+
+    On a fresh container (ephemeral disk) the blob restored from the
+    Gist still carries visit_history but history.jsonl doesn't exist
+    yet; without seeding, the first sync would overwrite the restored
+    records with just the new file contents. Blob history is
+    newest-first, the log oldest-first.
+    """
+    if not history:
+        return
+
+    with _history_lock:
+        DATA_DIR.mkdir(exist_ok=True)
+        if HISTORY_FILE.exists() and HISTORY_FILE.stat().st_size > 0:
+            return
+        HISTORY_FILE.write_bytes(
+            b"".join(_dump_line(_compact_record(r)) for r in reversed(history))
+        )
+
+
+def _read_history_file() -> list:
+    """Parse the history log, oldest record first."""
+    if not HISTORY_FILE.exists():
+        return []
+
+    records = []
+    for line in HISTORY_FILE.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        try:
+            # One-shot migration: records written before the compact
+            # schema get translated on read, and the next hourly
+            # compaction rewrites the file with short keys
+            records.append(_compact_record(_load_bytes(line)))
+        except Exception:
+            continue  # Skip a torn/corrupt line rather than losing the file
+    return records
+
+
+def _maybe_sync_history():
+    """Compact the history log and sync it to the blob at most hourly.
+
+    Keeps cleanup and the Gist round-trip off the per-visit hot path:
+    inserts are plain appends, and the trimmed history rides along in
+    the data blob (hence to the Gist) once per interval.
+    """
+    global _last_history_sync
+
+    now = time.time()
+    if now - _last_history_sync < HISTORY_SYNC_INTERVAL_SECONDS:
+        return
+    _last_history_sync = now
+
+    with _history_lock:
+        records = _read_history_file()
+        records.reverse()  # newest first, like the blob kept it
+        records = _cleanup_old_history(records)[:MAX_HISTORY]
+        HISTORY_FILE.write_bytes(b"".join(_dump_line(r) for r in reversed(records)))
+
+    def mutator(data):
+        data["visit_history"] = records
+
+    _mutate(mutator)
 
 
 def get_visit_history(limit: int = 50) -> list:
-    """Get recent visit history."""
-    data = _load_data()
-    history = data.get("visit_history", [])
-    return history[:limit]
+    """Get recent visit history, newest first."""
+    with _history_lock:
+        records = _read_history_file()
+
+    if not records:
+        # Fall back to history still in the blob (pre-split data, or a
+        # fresh process restored from the Gist)
+        data = _load_data_readonly()
+        return [_compact_record(r) for r in data.get("visit_history", [])[:limit]]
+
+    records.reverse()
+    return records[:limit]
 
 
 def clear_visit_history():
     """Clear all visit history."""
-    data = _load_data()
-    data["visit_history"] = []
-    _save_data(data)
+    with _history_lock:
+        if HISTORY_FILE.exists():
+            HISTORY_FILE.write_bytes(b"")
+
+    def mutator(data):
+        if data.get("visit_history"):
+            data["visit_history"] = []
+
+    _mutate(mutator)
 